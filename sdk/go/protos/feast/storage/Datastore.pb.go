@@ -0,0 +1,211 @@
+//
+// Copyright 2021 The Feast Authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     https://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+// Code generated by protoc-gen-go. DO NOT EDIT.
+// versions:
+// 	protoc-gen-go v1.25.0
+// 	protoc        v3.12.4
+// source: feast/storage/Datastore.proto
+
+package storage
+
+import (
+	types "github.com/feast-dev/feast/sdk/go/protos/feast/types"
+	proto "github.com/golang/protobuf/proto"
+	timestamp "github.com/golang/protobuf/ptypes/timestamp"
+	protoreflect "google.golang.org/protobuf/reflect/protoreflect"
+	protoimpl "google.golang.org/protobuf/runtime/protoimpl"
+	reflect "reflect"
+	sync "sync"
+)
+
+const (
+	// Verify that this generated code is sufficiently up-to-date.
+	_ = protoimpl.EnforceVersion(20 - protoimpl.MinVersion)
+	// Verify that runtime/protoimpl is sufficiently up-to-date.
+	_ = protoimpl.EnforceVersion(protoimpl.MaxVersion - 20)
+)
+
+// This is a compile-time assertion that a sufficiently up-to-date version
+// of the legacy proto package is being used.
+const _ = proto.ProtoPackageIsVersion4
+
+// Feature values of a single row in the Datastore online store, stored as one serialized
+// message so that a row can be decoded with a single parse.
+type DatastoreFeatureRow struct {
+	state         protoimpl.MessageState
+	sizeCache     protoimpl.SizeCache
+	unknownFields protoimpl.UnknownFields
+
+	Fields []*types.Field `protobuf:"bytes,1,rep,name=fields,proto3" json:"fields,omitempty"`
+	// Timestamps of the row that these fields were written for. Older SDKs rewrite rows without
+	// updating this message, so the fields are only current while these match the timestamps
+	// stored on the Datastore entity.
+	EventTimestamp   *timestamp.Timestamp `protobuf:"bytes,2,opt,name=event_timestamp,json=eventTimestamp,proto3" json:"event_timestamp,omitempty"`
+	CreatedTimestamp *timestamp.Timestamp `protobuf:"bytes,3,opt,name=created_timestamp,json=createdTimestamp,proto3" json:"created_timestamp,omitempty"`
+}
+
+func (x *DatastoreFeatureRow) Reset() {
+	*x = DatastoreFeatureRow{}
+	if protoimpl.UnsafeEnabled {
+		mi := &file_feast_storage_Datastore_proto_msgTypes[0]
+		ms := protoimpl.X.MessageStateOf(protoimpl.Pointer(x))
+		ms.StoreMessageInfo(mi)
+	}
+}
+
+func (x *DatastoreFeatureRow) String() string {
+	return protoimpl.X.MessageStringOf(x)
+}
+
+func (*DatastoreFeatureRow) ProtoMessage() {}
+
+func (x *DatastoreFeatureRow) ProtoReflect() protoreflect.Message {
+	mi := &file_feast_storage_Datastore_proto_msgTypes[0]
+	if protoimpl.UnsafeEnabled && x != nil {
+		ms := protoimpl.X.MessageStateOf(protoimpl.Pointer(x))
+		if ms.LoadMessageInfo() == nil {
+			ms.StoreMessageInfo(mi)
+		}
+		return ms
+	}
+	return mi.MessageOf(x)
+}
+
+// Deprecated: Use DatastoreFeatureRow.ProtoReflect.Descriptor instead.
+func (*DatastoreFeatureRow) Descriptor() ([]byte, []int) {
+	return file_feast_storage_Datastore_proto_rawDescGZIP(), []int{0}
+}
+
+func (x *DatastoreFeatureRow) GetFields() []*types.Field {
+	if x != nil {
+		return x.Fields
+	}
+	return nil
+}
+
+func (x *DatastoreFeatureRow) GetEventTimestamp() *timestamp.Timestamp {
+	if x != nil {
+		return x.EventTimestamp
+	}
+	return nil
+}
+
+func (x *DatastoreFeatureRow) GetCreatedTimestamp() *timestamp.Timestamp {
+	if x != nil {
+		return x.CreatedTimestamp
+	}
+	return nil
+}
+
+var File_feast_storage_Datastore_proto protoreflect.FileDescriptor
+
+var file_feast_storage_Datastore_proto_rawDesc = []byte{
+	0x0a, 0x1d, 0x66, 0x65, 0x61, 0x73, 0x74, 0x2f, 0x73, 0x74, 0x6f, 0x72, 0x61, 0x67, 0x65, 0x2f,
+	0x44, 0x61, 0x74, 0x61, 0x73, 0x74, 0x6f, 0x72, 0x65, 0x2e, 0x70, 0x72, 0x6f, 0x74, 0x6f, 0x12,
+	0x0d, 0x66, 0x65, 0x61, 0x73, 0x74, 0x2e, 0x73, 0x74, 0x6f, 0x72, 0x61, 0x67, 0x65, 0x1a, 0x1f,
+	0x67, 0x6f, 0x6f, 0x67, 0x6c, 0x65, 0x2f, 0x70, 0x72, 0x6f, 0x74, 0x6f, 0x62, 0x75, 0x66, 0x2f,
+	0x74, 0x69, 0x6d, 0x65, 0x73, 0x74, 0x61, 0x6d, 0x70, 0x2e, 0x70, 0x72, 0x6f, 0x74, 0x6f, 0x1a,
+	0x17, 0x66, 0x65, 0x61, 0x73, 0x74, 0x2f, 0x74, 0x79, 0x70, 0x65, 0x73, 0x2f, 0x46, 0x69, 0x65,
+	0x6c, 0x64, 0x2e, 0x70, 0x72, 0x6f, 0x74, 0x6f, 0x22, 0xcf, 0x01, 0x0a, 0x13, 0x44, 0x61, 0x74,
+	0x61, 0x73, 0x74, 0x6f, 0x72, 0x65, 0x46, 0x65, 0x61, 0x74, 0x75, 0x72, 0x65, 0x52, 0x6f, 0x77,
+	0x12, 0x2a, 0x0a, 0x06, 0x66, 0x69, 0x65, 0x6c, 0x64, 0x73, 0x18, 0x01, 0x20, 0x03, 0x28, 0x0b,
+	0x32, 0x12, 0x2e, 0x66, 0x65, 0x61, 0x73, 0x74, 0x2e, 0x74, 0x79, 0x70, 0x65, 0x73, 0x2e, 0x46,
+	0x69, 0x65, 0x6c, 0x64, 0x52, 0x06, 0x66, 0x69, 0x65, 0x6c, 0x64, 0x73, 0x12, 0x43, 0x0a, 0x0f,
+	0x65, 0x76, 0x65, 0x6e, 0x74, 0x5f, 0x74, 0x69, 0x6d, 0x65, 0x73, 0x74, 0x61, 0x6d, 0x70, 0x18,
+	0x02, 0x20, 0x01, 0x28, 0x0b, 0x32, 0x1a, 0x2e, 0x67, 0x6f, 0x6f, 0x67, 0x6c, 0x65, 0x2e, 0x70,
+	0x72, 0x6f, 0x74, 0x6f, 0x62, 0x75, 0x66, 0x2e, 0x54, 0x69, 0x6d, 0x65, 0x73, 0x74, 0x61, 0x6d,
+	0x70, 0x52, 0x0e, 0x65, 0x76, 0x65, 0x6e, 0x74, 0x54, 0x69, 0x6d, 0x65, 0x73, 0x74, 0x61, 0x6d,
+	0x70, 0x12, 0x47, 0x0a, 0x11, 0x63, 0x72, 0x65, 0x61, 0x74, 0x65, 0x64, 0x5f, 0x74, 0x69, 0x6d,
+	0x65, 0x73, 0x74, 0x61, 0x6d, 0x70, 0x18, 0x03, 0x20, 0x01, 0x28, 0x0b, 0x32, 0x1a, 0x2e, 0x67,
+	0x6f, 0x6f, 0x67, 0x6c, 0x65, 0x2e, 0x70, 0x72, 0x6f, 0x74, 0x6f, 0x62, 0x75, 0x66, 0x2e, 0x54,
+	0x69, 0x6d, 0x65, 0x73, 0x74, 0x61, 0x6d, 0x70, 0x52, 0x10, 0x63, 0x72, 0x65, 0x61, 0x74, 0x65,
+	0x64, 0x54, 0x69, 0x6d, 0x65, 0x73, 0x74, 0x61, 0x6d, 0x70, 0x42, 0x5d, 0x0a, 0x13, 0x66, 0x65,
+	0x61, 0x73, 0x74, 0x2e, 0x70, 0x72, 0x6f, 0x74, 0x6f, 0x2e, 0x73, 0x74, 0x6f, 0x72, 0x61, 0x67,
+	0x65, 0x42, 0x0e, 0x44, 0x61, 0x74, 0x61, 0x73, 0x74, 0x6f, 0x72, 0x65, 0x50, 0x72, 0x6f, 0x74,
+	0x6f, 0x5a, 0x36, 0x67, 0x69, 0x74, 0x68, 0x75, 0x62, 0x2e, 0x63, 0x6f, 0x6d, 0x2f, 0x66, 0x65,
+	0x61, 0x73, 0x74, 0x2d, 0x64, 0x65, 0x76, 0x2f, 0x66, 0x65, 0x61, 0x73, 0x74, 0x2f, 0x73, 0x64,
+	0x6b, 0x2f, 0x67, 0x6f, 0x2f, 0x70, 0x72, 0x6f, 0x74, 0x6f, 0x73, 0x2f, 0x66, 0x65, 0x61, 0x73,
+	0x74, 0x2f, 0x73, 0x74, 0x6f, 0x72, 0x61, 0x67, 0x65, 0x62, 0x06, 0x70, 0x72, 0x6f, 0x74, 0x6f,
+	0x33,
+}
+
+var (
+	file_feast_storage_Datastore_proto_rawDescOnce sync.Once
+	file_feast_storage_Datastore_proto_rawDescData = file_feast_storage_Datastore_proto_rawDesc
+)
+
+func file_feast_storage_Datastore_proto_rawDescGZIP() []byte {
+	file_feast_storage_Datastore_proto_rawDescOnce.Do(func() {
+		file_feast_storage_Datastore_proto_rawDescData = protoimpl.X.CompressGZIP(file_feast_storage_Datastore_proto_rawDescData)
+	})
+	return file_feast_storage_Datastore_proto_rawDescData
+}
+
+var file_feast_storage_Datastore_proto_msgTypes = make([]protoimpl.MessageInfo, 1)
+var file_feast_storage_Datastore_proto_goTypes = []interface{}{
+	(*DatastoreFeatureRow)(nil), // 0: feast.storage.DatastoreFeatureRow
+	(*types.Field)(nil),         // 1: feast.types.Field
+	(*timestamp.Timestamp)(nil), // 2: google.protobuf.Timestamp
+}
+var file_feast_storage_Datastore_proto_depIdxs = []int32{
+	1, // 0: feast.storage.DatastoreFeatureRow.fields:type_name -> feast.types.Field
+	2, // 1: feast.storage.DatastoreFeatureRow.event_timestamp:type_name -> google.protobuf.Timestamp
+	2, // 2: feast.storage.DatastoreFeatureRow.created_timestamp:type_name -> google.protobuf.Timestamp
+	3, // [3:3] is the sub-list for method output_type
+	3, // [3:3] is the sub-list for method input_type
+	3, // [3:3] is the sub-list for extension type_name
+	3, // [3:3] is the sub-list for extension extendee
+	0, // [0:3] is the sub-list for field type_name
+}
+
+func init() { file_feast_storage_Datastore_proto_init() }
+func file_feast_storage_Datastore_proto_init() {
+	if File_feast_storage_Datastore_proto != nil {
+		return
+	}
+	if !protoimpl.UnsafeEnabled {
+		file_feast_storage_Datastore_proto_msgTypes[0].Exporter = func(v interface{}, i int) interface{} {
+			switch v := v.(*DatastoreFeatureRow); i {
+			case 0:
+				return &v.state
+			case 1:
+				return &v.sizeCache
+			case 2:
+				return &v.unknownFields
+			default:
+				return nil
+			}
+		}
+	}
+	type x struct{}
+	out := protoimpl.TypeBuilder{
+		File: protoimpl.DescBuilder{
+			GoPackagePath: reflect.TypeOf(x{}).PkgPath(),
+			RawDescriptor: file_feast_storage_Datastore_proto_rawDesc,
+			NumEnums:      0,
+			NumMessages:   1,
+			NumExtensions: 0,
+			NumServices:   0,
+		},
+		GoTypes:           file_feast_storage_Datastore_proto_goTypes,
+		DependencyIndexes: file_feast_storage_Datastore_proto_depIdxs,
+		MessageInfos:      file_feast_storage_Datastore_proto_msgTypes,
+	}.Build()
+	File_feast_storage_Datastore_proto = out.File
+	file_feast_storage_Datastore_proto_rawDesc = nil
+	file_feast_storage_Datastore_proto_goTypes = nil
+	file_feast_storage_Datastore_proto_depIdxs = nil
+}
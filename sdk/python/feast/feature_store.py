@@ -46,6 +46,7 @@ class FeatureStore:
     config: RepoConfig
     repo_path: Optional[str]
     _registry: Registry
+    _provider: Optional[Provider]
 
     def __init__(
         self, repo_path: Optional[str] = None, config: Optional[RepoConfig] = None,
@@ -73,6 +74,7 @@ class FeatureStore:
             cache_ttl=timedelta(seconds=registry_config.cache_ttl_seconds),
         )
         self._tele = Telemetry()
+        self._provider = None
 
     def version(self) -> str:
         """Returns the version of the current Feast SDK/CLI"""
@@ -84,7 +86,11 @@ class FeatureStore:
         return self.config.project
 
     def _get_provider(self) -> Provider:
-        return get_provider(self.config)
+        # Reuse the provider across calls, so that the clients and thread pools it holds are set
+        # up once per FeatureStore rather than once per request
+        if self._provider is None:
+            self._provider = get_provider(self.config)
+        return self._provider
 
     def refresh_registry(self):
         """Fetches and caches a copy of the feature registry in memory.
@@ -1,11 +1,17 @@
-import itertools
+import contextlib
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from multiprocessing.pool import ThreadPool
 from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
 import mmh3
 import pandas
 import pyarrow
+from pytz import utc
 
 from feast import FeatureTable, utils
 from feast.data_source import BigQuerySource
@@ -19,28 +25,61 @@ from feast.infra.provider import (
     _get_column_names,
     _run_field_mapping,
 )
+from feast.protos.feast.storage.Datastore_pb2 import (
+    DatastoreFeatureRow as DatastoreFeatureRowProto,
+)
 from feast.protos.feast.types.EntityKey_pb2 import EntityKey as EntityKeyProto
+from feast.protos.feast.types.Field_pb2 import Field as FieldProto
 from feast.protos.feast.types.Value_pb2 import Value as ValueProto
 from feast.registry import Registry
 from feast.repo_config import DatastoreOnlineStoreConfig, RepoConfig
 
+MATERIALIZATION_CHUNK_SIZE = 50_000
+MATERIALIZATION_QUEUE_SIZE = 4
+MAX_LOOKUP_KEYS = 1000
+
 
 class GcpProvider(Provider):
     _gcp_project_id: Optional[str]
+    _client: Optional[Any]
+    _write_pool: Optional[ThreadPoolExecutor]
+    _write_concurrency: int
+    _write_in_transaction: bool
 
     def __init__(self, config: Optional[DatastoreOnlineStoreConfig]):
         if config:
             self._gcp_project_id = config.project_id
         else:
             self._gcp_project_id = None
+        self._client = None
+        self._write_pool = None
+        self._write_concurrency = _get_write_concurrency()
+        self._write_in_transaction = _get_write_in_transaction()
 
     def _initialize_client(self):
-        from google.cloud import datastore
-
-        if self._gcp_project_id is not None:
-            return datastore.Client(self._gcp_project_id)
-        else:
-            return datastore.Client()
+        """
+        Return the Datastore client, creating it on first use. The client is reused across
+        calls so that credentials and channel setup are only paid for once.
+        """
+        if self._client is None:
+            from google.cloud import datastore
+
+            if self._gcp_project_id is not None:
+                self._client = datastore.Client(self._gcp_project_id)
+            else:
+                self._client = datastore.Client()
+        return self._client
+
+    def _get_write_pool(self) -> ThreadPoolExecutor:
+        """
+        Return the thread pool used to write minibatches to Datastore, creating it on first use.
+        The pool lives as long as the provider, which FeatureStore keeps for its own lifetime.
+        """
+        if self._write_pool is None:
+            self._write_pool = ThreadPoolExecutor(
+                max_workers=self._write_concurrency, thread_name_prefix="ds-write",
+            )
+        return self._write_pool
 
     def update_infra(
         self,
@@ -59,28 +98,28 @@ class GcpProvider(Provider):
             entity.update({"created_ts": datetime.utcnow()})
             client.put(entity)
 
+        keys_to_delete = []
         for table in tables_to_delete:
-            _delete_all_values(
-                client, client.key("Project", project, "Table", table.name)
-            )
-
-            # Delete the table metadata datastore entity
             key = client.key("Project", project, "Table", table.name)
-            client.delete(key)
+            _delete_all_values(client, key)
+            keys_to_delete.append(key)
+
+        # Delete the table metadata datastore entities
+        client.delete_multi(keys_to_delete)
 
     def teardown_infra(
         self, project: str, tables: Sequence[Union[FeatureTable, FeatureView]]
     ) -> None:
         client = self._initialize_client()
 
+        keys_to_delete = []
         for table in tables:
-            _delete_all_values(
-                client, client.key("Project", project, "Table", table.name)
-            )
-
-            # Delete the table metadata datastore entity
             key = client.key("Project", project, "Table", table.name)
-            client.delete(key)
+            _delete_all_values(client, key)
+            keys_to_delete.append(key)
+
+        # Delete the table metadata datastore entities
+        client.delete_multi(keys_to_delete)
 
     def online_write_batch(
         self,
@@ -93,10 +132,15 @@ class GcpProvider(Provider):
     ) -> None:
         client = self._initialize_client()
 
-        pool = ThreadPool(processes=10)
-        pool.map(
-            lambda b: _write_minibatch(client, project, table, b, progress),
-            _to_minibatches(data),
+        pool = self._get_write_pool()
+        # Consume the results so that any exception raised in a worker is propagated here
+        list(
+            pool.map(
+                lambda b: _write_minibatch(
+                    client, project, table, b, progress, self._write_in_transaction
+                ),
+                _to_minibatches(data),
+            )
         )
 
     def online_read(
@@ -107,19 +151,42 @@ class GcpProvider(Provider):
     ) -> List[Tuple[Optional[datetime], Optional[Dict[str, ValueProto]]]]:
         client = self._initialize_client()
 
-        result: List[Tuple[Optional[datetime], Optional[Dict[str, ValueProto]]]] = []
-        for entity_key in entity_keys:
-            document_id = compute_datastore_entity_id(entity_key)
-            key = client.key(
-                "Project", project, "Table", table.name, "Row", document_id
+        keys = [
+            client.key(
+                "Project",
+                project,
+                "Table",
+                table.name,
+                "Row",
+                compute_datastore_entity_id(entity_key),
             )
-            value = client.get(key)
+            for entity_key in entity_keys
+        ]
+        # Datastore rejects lookups of more than 1000 keys, so look keys up in groups. get_multi
+        # does not preserve the order of the requested keys.
+        values: Dict[Any, Any] = {}
+        for i in range(0, len(keys), MAX_LOOKUP_KEYS):
+            for entity in client.get_multi(keys[i : i + MAX_LOOKUP_KEYS]):
+                values[entity.key] = entity
+
+        result: List[Tuple[Optional[datetime], Optional[Dict[str, ValueProto]]]] = []
+        for key in keys:
+            value = values.get(key)
             if value is not None:
-                res = {}
-                for feature_name, value_bin in value["values"].items():
-                    val = ValueProto()
-                    val.ParseFromString(value_bin)
-                    res[feature_name] = val
+                row = (
+                    DatastoreFeatureRowProto.FromString(value["row"])
+                    if "row" in value
+                    else None
+                )
+                if row is not None and _is_current_row(row, value):
+                    res = {field.name: field.value for field in row.fields}
+                else:
+                    # Rows written before feature values were stored as a single message, or
+                    # rewritten since by an older SDK that only updated the "values" map
+                    res = {
+                        feature_name: ValueProto.FromString(value_bin)
+                        for feature_name, value_bin in value["values"].items()
+                    }
                 result.append((value["event_ts"], res))
             else:
                 result.append((None, None))
@@ -164,21 +231,15 @@ class GcpProvider(Provider):
             table = _run_field_mapping(table, feature_view.input.field_mapping)
 
         join_keys = [entity.join_key for entity in entities]
-        rows_to_write = _convert_arrow_to_proto(table, feature_view, join_keys)
-
-        self.online_write_batch(project, feature_view, rows_to_write, None)
+        with contextlib.closing(
+            _convert_in_chunks(table, feature_view, join_keys)
+        ) as chunks:
+            for rows_to_write in chunks:
+                self.online_write_batch(project, feature_view, rows_to_write, None)
 
         feature_view.materialization_intervals.append((start_date, end_date))
         registry.apply_feature_view(feature_view, project)
 
-    @staticmethod
-    def _pull_query(query: str) -> pyarrow.Table:
-        from google.cloud import bigquery
-
-        client = bigquery.Client()
-        query_job = client.query(query)
-        return query_job.to_arrow()
-
     @staticmethod
     def get_historical_features(
         config: RepoConfig,
@@ -202,24 +263,111 @@ class GcpProvider(Provider):
         return job
 
 
+def _get_write_concurrency() -> int:
+    """
+    Read the number of concurrent Datastore writers from the FEAST_DATASTORE_WRITE_CONCURRENCY
+    environment variable, defaulting to 10.
+    """
+    value = os.getenv("FEAST_DATASTORE_WRITE_CONCURRENCY", "10")
+    try:
+        concurrency = int(value)
+    except ValueError:
+        concurrency = 0
+    if concurrency < 1:
+        raise ValueError(
+            f"FEAST_DATASTORE_WRITE_CONCURRENCY must be a positive integer, got {value!r}"
+        )
+    return concurrency
+
+
+def _get_write_in_transaction() -> bool:
+    """
+    Read whether Datastore writes use transactions from the FEAST_DATASTORE_WRITE_IN_TRANSACTION
+    environment variable, defaulting to True. Without transactions a concurrent writer may
+    overwrite fresher feature values with older ones, so only an explicit "False" disables them.
+    """
+    value = os.getenv("FEAST_DATASTORE_WRITE_IN_TRANSACTION", "True")
+    if value.lower() == "true":
+        return True
+    if value.lower() == "false":
+        return False
+    raise ValueError(
+        f"FEAST_DATASTORE_WRITE_IN_TRANSACTION must be True or False, got {value!r}"
+    )
+
+
 ProtoBatch = Sequence[
     Tuple[EntityKeyProto, Dict[str, ValueProto], datetime, Optional[datetime]]
 ]
 
 
+def _convert_in_chunks(
+    table: pyarrow.Table, feature_view: FeatureView, join_keys: List[str]
+) -> Iterator[
+    List[Tuple[EntityKeyProto, Dict[str, ValueProto], datetime, Optional[datetime]]]
+]:
+    """
+    Convert table to protos in chunks of MATERIALIZATION_CHUNK_SIZE rows, so that only a few
+    chunks worth of protos are held in memory at a time rather than the whole table.
+
+    Chunks are converted in a background thread while the caller writes the previous ones, and
+    the converter runs at most MATERIALIZATION_QUEUE_SIZE chunks ahead of the caller.
+    Conversion errors are raised to the caller.
+    """
+    chunks: queue.Queue = queue.Queue(maxsize=MATERIALIZATION_QUEUE_SIZE)
+    stopped = threading.Event()
+
+    def _put(item) -> bool:
+        # Stop waiting for room in the queue once the caller is gone, e.g. after a failed write
+        while not stopped.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _convert():
+        try:
+            # Slicing (unlike to_batches) spans record batch boundaries, so many small BigQuery
+            # result pages still give full chunks
+            for offset in range(0, table.num_rows, MATERIALIZATION_CHUNK_SIZE):
+                rows = _convert_arrow_to_proto(
+                    table.slice(offset, MATERIALIZATION_CHUNK_SIZE),
+                    feature_view,
+                    join_keys,
+                )
+                if not _put(rows):
+                    return
+        except Exception as e:
+            _put(e)
+        else:
+            _put(None)
+
+    converter = threading.Thread(
+        target=_convert, name="materialize-convert", daemon=True
+    )
+    converter.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        converter.join()
+
+
 def _to_minibatches(data: ProtoBatch, batch_size=50) -> Iterator[ProtoBatch]:
     """
     Split data into minibatches, making sure we stay under GCP datastore transaction size
     limits.
     """
-    iterable = iter(data)
-
-    while True:
-        batch = list(itertools.islice(iterable, batch_size))
-        if len(batch) > 0:
-            yield batch
-        else:
-            break
+    for i in range(0, len(data), batch_size):
+        yield data[i : i + batch_size]
 
 
 def _write_minibatch(
@@ -230,9 +378,55 @@ def _write_minibatch(
         Tuple[EntityKeyProto, Dict[str, ValueProto], datetime, Optional[datetime]]
     ],
     progress: Optional[Callable[[int], Any]],
+    use_transaction: bool = True,
 ):
+    """
+    Write a minibatch of rows to datastore.
+
+    If use_transaction is set, the freshness check and the write happen atomically inside a
+    transaction that is retried on conflicts. Otherwise rows are read and written with plain
+    batch calls, which is faster but may let a concurrent writer of the same rows win with
+    older data.
+    """
     from google.api_core.exceptions import Conflict
-    from google.cloud import datastore
+
+    # Everything written to Datastore only depends on the input data, so compute keys and
+    # serialize rows once up front rather than on every retry
+    rows = []
+    for entity_key, features, timestamp, created_ts in data:
+        key = client.key(
+            "Project",
+            project,
+            "Table",
+            table.name,
+            "Row",
+            compute_datastore_entity_id(entity_key),
+        )
+        event_ts = utils.make_tzaware(timestamp)
+        if created_ts is not None:
+            created_ts = utils.make_tzaware(created_ts)
+        row = DatastoreFeatureRowProto(
+            fields=[FieldProto(name=k, value=v) for k, v in features.items()]
+        )
+        row.event_timestamp.FromDatetime(_to_naive_utc(event_ts))
+        if created_ts is not None:
+            row.created_timestamp.FromDatetime(_to_naive_utc(created_ts))
+        values = dict(
+            key=entity_key.SerializeToString(),
+            row=row.SerializeToString(),
+            # Older SDKs only read the "values" map, so keep writing it alongside "row" for one
+            # release. Stop writing it once those SDKs are no longer supported.
+            values={k: v.SerializeToString() for k, v in features.items()},
+            event_ts=event_ts,
+            created_ts=created_ts,
+        )
+        rows.append((key, values))
+
+    if not use_transaction:
+        row_count = _put_fresher_rows(client, rows)
+        if progress:
+            progress(row_count)
+        return
 
     num_retries_on_conflict = 3
     row_count = 0
@@ -240,53 +434,78 @@ def _write_minibatch(
         try:
             row_count = 0
             with client.transaction():
-                for entity_key, features, timestamp, created_ts in data:
-                    document_id = compute_datastore_entity_id(entity_key)
-
-                    key = client.key(
-                        "Project", project, "Table", table.name, "Row", document_id,
-                    )
-
-                    entity = client.get(key)
-                    if entity is not None:
-                        if entity["event_ts"] > utils.make_tzaware(timestamp):
-                            # Do not overwrite feature values computed from fresher data
-                            continue
-                        elif (
-                            entity["event_ts"] == utils.make_tzaware(timestamp)
-                            and created_ts is not None
-                            and entity["created_ts"] is not None
-                            and entity["created_ts"] > utils.make_tzaware(created_ts)
-                        ):
-                            # Do not overwrite feature values computed from the same data, but
-                            # computed later than this one
-                            continue
-                    else:
-                        entity = datastore.Entity(key=key)
-
-                    entity.update(
-                        dict(
-                            key=entity_key.SerializeToString(),
-                            values={
-                                k: v.SerializeToString() for k, v in features.items()
-                            },
-                            event_ts=utils.make_tzaware(timestamp),
-                            created_ts=(
-                                utils.make_tzaware(created_ts)
-                                if created_ts is not None
-                                else None
-                            ),
-                        )
-                    )
-                    client.put(entity)
-                    row_count += 1
-
-                    if progress:
-                        progress(1)
+                row_count = _put_fresher_rows(client, rows)
+
+            if progress:
+                progress(row_count)
             break  # make sure to break out of retry loop if all went well
         except Conflict:
             if retry_number == num_retries_on_conflict - 1:
                 raise
+            # Back off exponentially with jitter so that concurrent writers contending for the
+            # same rows don't retry in lockstep
+            time.sleep((2 ** retry_number) * 0.05 + random.random() * 0.05)
+
+
+def _put_fresher_rows(client, rows: Sequence[Tuple[Any, Dict[str, Any]]]) -> int:
+    """
+    Write the given rows to datastore, skipping rows for which datastore already holds values
+    computed from fresher data. Returns the number of rows written.
+    """
+    from google.cloud import datastore
+
+    # Datastore rejects non-transactional commits that mutate the same entity more than once, so
+    # only keep the last row for each key
+    rows_by_key = {key: values for key, values in rows}
+
+    existing_entities = {
+        entity.key: entity for entity in client.get_multi(list(rows_by_key))
+    }
+
+    entities_to_put = []
+    for key, values in rows_by_key.items():
+        entity = existing_entities.get(key)
+        if entity is not None:
+            if entity["event_ts"] > values["event_ts"]:
+                # Do not overwrite feature values computed from fresher data
+                continue
+            elif (
+                entity["event_ts"] == values["event_ts"]
+                and values["created_ts"] is not None
+                and entity["created_ts"] is not None
+                and entity["created_ts"] > values["created_ts"]
+            ):
+                # Do not overwrite feature values computed from the same data, but
+                # computed later than this one
+                continue
+        else:
+            entity = datastore.Entity(key=key)
+
+        entity.exclude_from_indexes.add("row")
+        entity.update(values)
+        entities_to_put.append(entity)
+
+    client.put_multi(entities_to_put)
+    return len(entities_to_put)
+
+
+def _to_naive_utc(t: datetime) -> datetime:
+    return t.astimezone(utc).replace(tzinfo=None)
+
+
+def _is_current_row(row: DatastoreFeatureRowProto, entity) -> bool:
+    """
+    Check whether the fields in row are the current feature values of the given Datastore
+    entity. Older SDKs rewrite entities without updating "row", which then no longer matches
+    the timestamps stored on the entity.
+    """
+    if utils.make_tzaware(row.event_timestamp.ToDatetime()) != entity["event_ts"]:
+        return False
+    if row.HasField("created_timestamp"):
+        return utils.make_tzaware(row.created_timestamp.ToDatetime()) == entity.get(
+            "created_ts"
+        )
+    return entity.get("created_ts") is None
 
 
 def _delete_all_values(client, key) -> None:
@@ -295,12 +514,14 @@ def _delete_all_values(client, key) -> None:
     """
     while True:
         query = client.query(kind="Row", ancestor=key)
-        entities = list(query.fetch(limit=1000))
+        # Only the keys are needed for deletion, so don't fetch the feature values
+        query.keys_only()
+        # Datastore allows at most 500 mutations per commit
+        entities = list(query.fetch(limit=500))
         if not entities:
             return
 
-        for entity in entities:
-            client.delete(entity.key)
+        client.delete_multi([entity.key for entity in entities])
 
 
 def compute_datastore_entity_id(entity_key: EntityKeyProto) -> str:
@@ -309,5 +530,8 @@ def compute_datastore_entity_id(entity_key: EntityKeyProto) -> str:
 
     Remember that Datastore Entity is a concept from the Datastore data model, that has nothing to
     do with the Entity concept we have in Feast.
+
+    The returned id is used as the Datastore key name of stored rows, so its format must stay
+    stable across releases; changing it would orphan all previously materialized data.
     """
     return mmh3.hash_bytes(serialize_entity_key(entity_key)).hex()
@@ -5,6 +5,15 @@ from feast.protos.feast.types.EntityKey_pb2 import EntityKey as EntityKeyProto
 from feast.protos.feast.types.Value_pb2 import Value as ValueProto
 from feast.protos.feast.types.Value_pb2 import ValueType
 
+# Precompiled struct formats, since these are used for every row during materialization
+_INT32_STRUCT = struct.Struct("<i")
+# "<l" packs int64 values into 4 bytes, as the original struct.pack("<l", ...) call did.
+# Serialized entity keys are hashed into persisted online store ids, so this encoding must not
+# be changed to the 8-byte "<q" without migrating existing data.
+_INT64_STRUCT = struct.Struct("<l")
+_UINT32_STRUCT = struct.Struct("<I")
+_STRING_TYPE_BYTES = _UINT32_STRUCT.pack(ValueType.STRING)
+
 
 def _serialize_val(value_type, v: ValueProto) -> Tuple[bytes, int]:
     if value_type == "string_val":
@@ -12,9 +21,9 @@ def _serialize_val(value_type, v: ValueProto) -> Tuple[bytes, int]:
     elif value_type == "bytes_val":
         return v.bytes_val, ValueType.BYTES
     elif value_type == "int32_val":
-        return struct.pack("<i", v.int32_val), ValueType.INT32
+        return _INT32_STRUCT.pack(v.int32_val), ValueType.INT32
     elif value_type == "int64_val":
-        return struct.pack("<l", v.int64_val), ValueType.INT64
+        return _INT64_STRUCT.pack(v.int64_val), ValueType.INT64
     else:
         raise ValueError(f"Value type not supported for Firestore: {v}")
 
@@ -35,14 +44,14 @@ def serialize_entity_key(entity_key: EntityKeyProto) -> bytes:
 
     output: List[bytes] = []
     for k in sorted_keys:
-        output.append(struct.pack("<I", ValueType.STRING))
+        output.append(_STRING_TYPE_BYTES)
         output.append(k.encode("utf8"))
     for v in sorted_values:
         val_bytes, value_type = _serialize_val(v.WhichOneof("val"), v)
 
-        output.append(struct.pack("<I", value_type))
+        output.append(_UINT32_STRUCT.pack(value_type))
 
-        output.append(struct.pack("<I", len(val_bytes)))
+        output.append(_UINT32_STRUCT.pack(len(val_bytes)))
         output.append(val_bytes)
 
     return b"".join(output)
@@ -135,9 +135,7 @@ class LocalProvider(Provider):
             res = {}
             res_ts = None
             for feature_name, val_bin, ts in cur.fetchall():
-                val = ValueProto()
-                val.ParseFromString(val_bin)
-                res[feature_name] = val
+                res[feature_name] = ValueProto.FromString(val_bin)
                 res_ts = ts
 
             if not res:
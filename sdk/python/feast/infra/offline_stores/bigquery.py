@@ -1,3 +1,4 @@
+import threading
 import time
 from dataclasses import asdict, dataclass
 from datetime import datetime, timedelta
@@ -18,6 +19,21 @@ from feast.infra.provider import (
 from feast.registry import Registry
 from feast.repo_config import RepoConfig
 
+_bigquery_client: Optional[bigquery.Client] = None
+_bigquery_client_lock = threading.Lock()
+
+
+def _get_bigquery_client() -> bigquery.Client:
+    """
+    Return a BigQuery client shared across queries, creating it on first use. Creating a client
+    performs credential discovery, so we avoid doing it for every query.
+    """
+    global _bigquery_client
+    with _bigquery_client_lock:
+        if _bigquery_client is None:
+            _bigquery_client = bigquery.Client()
+        return _bigquery_client
+
 
 class BigQueryOfflineStore(OfflineStore):
     @staticmethod
@@ -59,9 +75,7 @@ class BigQueryOfflineStore(OfflineStore):
 
     @staticmethod
     def _pull_query(query: str) -> pyarrow.Table:
-        from google.cloud import bigquery
-
-        client = bigquery.Client()
+        client = _get_bigquery_client()
         query_job = client.query(query)
         return query_job.to_arrow()
 
@@ -110,7 +124,7 @@ class BigQueryRetrievalJob(RetrievalJob):
 
     def to_df(self):
         # TODO: Ideally only start this job when the user runs "get_historical_features", not when they run to_df()
-        client = bigquery.Client()
+        client = _get_bigquery_client()
         df = client.query(self.query).to_dataframe(create_bqstorage_client=True)
         return df
 
@@ -133,7 +147,7 @@ class FeatureViewQueryContext:
 
 def _upload_entity_df_into_bigquery(project, entity_df) -> str:
     """Uploads a Pandas entity dataframe into a BigQuery table and returns a reference to the resulting table"""
-    client = bigquery.Client()
+    client = _get_bigquery_client()
 
     # First create the BigQuery dataset if it doesn't exist
     dataset = bigquery.Dataset(f"{client.project}.feast_{project}")
@@ -1,6 +1,6 @@
 import abc
 from datetime import datetime
-from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union, cast
 
 import pandas
 import pyarrow
@@ -237,7 +237,7 @@ def _convert_arrow_to_proto(
 
     def _coerce_datetime(ts):
         """
-        Depending on underlying time resolution, arrow to_pydict() sometimes returns pandas
+        Depending on underlying time resolution, arrow to_pylist() sometimes returns pandas
         timestamp type (for nanosecond resolution), and sometimes you get standard python datetime
         (for microsecond resolution).
 
@@ -251,31 +251,47 @@ def _convert_arrow_to_proto(
         else:
             return ts
 
-    for row in zip(*table.to_pydict().values()):
-        entity_key = EntityKeyProto()
-        for join_key in join_keys:
-            entity_key.join_keys.append(join_key)
-            idx = table.column_names.index(join_key)
-            value = python_value_to_proto_value(row[idx])
-            entity_key.entity_values.append(value)
-        feature_dict = {}
-        for feature in feature_view.features:
-            idx = table.column_names.index(feature.name)
-            value = python_value_to_proto_value(row[idx])
-            feature_dict[feature.name] = value
-        event_timestamp_idx = table.column_names.index(
-            feature_view.input.event_timestamp_column
-        )
-        event_timestamp = _coerce_datetime(row[event_timestamp_idx])
+    def _timestamp_column(column_name: str) -> List[Optional[datetime]]:
+        column = table.column(column_name)
+        if pyarrow.types.is_timestamp(column.type) and column.type.tz is None:
+            # tz-naive timestamps are assumed to be UTC. Tag the whole column as UTC at once, so
+            # that the datetimes handed downstream are already tz-aware.
+            column = column.cast(pyarrow.timestamp(column.type.unit, tz="UTC"))
+        return [_coerce_datetime(ts) for ts in column.to_pylist()]
 
-        if feature_view.input.created_timestamp_column is not None:
-            created_timestamp_idx = table.column_names.index(
-                feature_view.input.created_timestamp_column
-            )
-            created_timestamp = _coerce_datetime(row[created_timestamp_idx])
-        else:
-            created_timestamp = None
+    # Convert the table column by column, so that column positions are resolved once per
+    # column rather than once per row, and then stitch the converted columns into rows.
+    feature_names = [feature.name for feature in feature_view.features]
+    proto_columns = {
+        column: [
+            python_value_to_proto_value(value)
+            for value in table.column(column).to_pylist()
+        ]
+        for column in join_keys + feature_names
+    }
+    # Only the created timestamp column is optional, rows always have an event timestamp
+    event_timestamps = cast(
+        List[datetime], _timestamp_column(feature_view.input.event_timestamp_column)
+    )
+    created_timestamps: List[Optional[datetime]]
+    if feature_view.input.created_timestamp_column is not None:
+        created_timestamps = _timestamp_column(
+            feature_view.input.created_timestamp_column
+        )
+    else:
+        created_timestamps = [None] * table.num_rows
 
+    for idx, (event_timestamp, created_timestamp) in enumerate(
+        zip(event_timestamps, created_timestamps)
+    ):
+        entity_key = EntityKeyProto(
+            join_keys=join_keys,
+            entity_values=[proto_columns[join_key][idx] for join_key in join_keys],
+        )
+        feature_dict = {
+            feature_name: proto_columns[feature_name][idx]
+            for feature_name in feature_names
+        }
         rows_to_write.append(
             (entity_key, feature_dict, event_timestamp, created_timestamp)
         )
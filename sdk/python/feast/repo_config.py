@@ -4,6 +4,12 @@ from typing import Optional, Union
 import yaml
 from pydantic import BaseModel, StrictInt, StrictStr, ValidationError
 
+try:
+    # Use the libyaml-backed loader when PyYAML was built with libyaml support
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader  # type: ignore
+
 
 class FeastBaseModel(BaseModel):
     """ Feast Pydantic Configuration Class """
@@ -127,8 +133,8 @@ def load_repo_config(repo_path: Path) -> RepoConfig:
     config_path = repo_path / "feature_store.yaml"
 
     with open(config_path) as f:
-        raw_config = yaml.safe_load(f)
+        raw_config = yaml.load(f, Loader=SafeLoader)
         try:
-            return RepoConfig(**raw_config)
+            return RepoConfig.parse_obj(raw_config)
         except ValidationError as e:
             raise FeastConfigError(e, config_path)
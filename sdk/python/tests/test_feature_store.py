@@ -306,3 +306,10 @@ def test_apply_object_and_read(test_feature_store):
     assert e1 == e1_actual
     assert fv2 != fv1_actual
     assert e2 != e1_actual
+
+
+@pytest.mark.parametrize(
+    "test_feature_store", [lazy_fixture("feature_store_with_local_registry")],
+)
+def test_provider_is_reused(test_feature_store):
+    assert test_feature_store._get_provider() is test_feature_store._get_provider()
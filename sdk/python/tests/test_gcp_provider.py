@@ -0,0 +1,454 @@
+import contextlib
+import threading
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pyarrow as pa
+import pytest
+from google.cloud import datastore
+from pytz import utc
+
+from feast.data_source import BigQuerySource
+from feast.entity import Entity
+from feast.feature import Feature
+from feast.feature_view import FeatureView
+from feast.infra.gcp import GcpProvider, compute_datastore_entity_id
+from feast.infra.provider import _convert_arrow_to_proto
+from feast.protos.feast.storage.Datastore_pb2 import (
+    DatastoreFeatureRow as DatastoreFeatureRowProto,
+)
+from feast.protos.feast.types.EntityKey_pb2 import EntityKey as EntityKeyProto
+from feast.protos.feast.types.Field_pb2 import Field as FieldProto
+from feast.protos.feast.types.Value_pb2 import Value as ValueProto
+from feast.value_type import ValueType
+
+
+class FakeDatastoreClient:
+    """
+    In-memory stand-in for datastore.Client, implementing the subset of the API used by
+    GcpProvider together with the Datastore request limits it has to respect.
+    """
+
+    def __init__(self):
+        self.entities = {}
+        self.lookup_sizes = []
+        self.transaction_count = 0
+        # Minibatches are written from several threads, each with its own transaction
+        self._local = threading.local()
+
+    def key(self, *path):
+        return datastore.Key(*path, project="test-project")
+
+    def get_multi(self, keys):
+        assert len(keys) <= 1000, "Datastore rejects lookups of more than 1000 keys"
+        self.lookup_sizes.append(len(keys))
+        result = []
+        for key in keys:
+            if key in self.entities:
+                stored = self.entities[key]
+                entity = datastore.Entity(
+                    key=key, exclude_from_indexes=tuple(stored.exclude_from_indexes)
+                )
+                entity.update(stored)
+                result.append(entity)
+        # Datastore does not return entities in the order of the requested keys
+        return list(reversed(result))
+
+    def put_multi(self, entities):
+        if not getattr(self._local, "in_transaction", False):
+            assert len({entity.key for entity in entities}) == len(
+                entities
+            ), "Datastore rejects non-transactional commits mutating an entity twice"
+        for entity in entities:
+            self.entities[entity.key] = entity
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self.transaction_count += 1
+        self._local.in_transaction = True
+        try:
+            yield
+        finally:
+            self._local.in_transaction = False
+
+
+def _get_provider_and_client():
+    provider = GcpProvider(None)
+    client = FakeDatastoreClient()
+    provider._client = client
+    return provider, client
+
+
+def _get_feature_view() -> FeatureView:
+    return FeatureView(
+        name="driver_locations",
+        entities=["driver"],
+        features=[Feature("lat", ValueType.DOUBLE)],
+        ttl=timedelta(days=1),
+        input=BigQuerySource(
+            table_ref="project:dataset.table",
+            event_timestamp_column="event_timestamp",
+            created_timestamp_column=None,
+        ),
+    )
+
+
+def _driver_key(driver_id: int) -> EntityKeyProto:
+    return EntityKeyProto(
+        join_keys=["driver"], entity_values=[ValueProto(int64_val=driver_id)]
+    )
+
+
+def test_online_read_more_than_lookup_limit():
+    provider, client = _get_provider_and_client()
+    table = _get_feature_view()
+    now = datetime.utcnow()
+
+    provider.online_write_batch(
+        project="test",
+        table=table,
+        data=[
+            (_driver_key(i), {"lat": ValueProto(double_val=i)}, now, None)
+            for i in range(0, 2500, 2)
+        ],
+        progress=None,
+    )
+
+    client.lookup_sizes.clear()
+    result = provider.online_read(
+        project="test", table=table, entity_keys=[_driver_key(i) for i in range(2500)],
+    )
+
+    assert client.lookup_sizes == [1000, 1000, 500]
+    assert len(result) == 2500
+    for i, (event_ts, values) in enumerate(result):
+        if i % 2 == 0:
+            assert event_ts is not None
+            assert values["lat"].double_val == i
+        else:
+            assert (event_ts, values) == (None, None)
+
+
+def test_write_pool_is_reused():
+    provider, _ = _get_provider_and_client()
+    table = _get_feature_view()
+    now = datetime.utcnow()
+
+    for _ in range(2):
+        provider.online_write_batch(
+            project="test",
+            table=table,
+            data=[(_driver_key(1), {"lat": ValueProto(double_val=1.0)}, now, None)],
+            progress=None,
+        )
+        pool = provider._get_write_pool()
+        assert pool._max_workers == 10
+        assert pool is provider._get_write_pool()
+
+
+@pytest.mark.parametrize("concurrency", ["0", "-1", "ten"])
+def test_invalid_write_concurrency(monkeypatch, concurrency):
+    monkeypatch.setenv("FEAST_DATASTORE_WRITE_CONCURRENCY", concurrency)
+    with pytest.raises(ValueError, match="FEAST_DATASTORE_WRITE_CONCURRENCY"):
+        GcpProvider(None)
+
+
+@pytest.mark.parametrize("write_in_transaction", ["1", "0", "yes", "no", ""])
+def test_invalid_write_in_transaction(monkeypatch, write_in_transaction):
+    monkeypatch.setenv("FEAST_DATASTORE_WRITE_IN_TRANSACTION", write_in_transaction)
+    with pytest.raises(ValueError, match="FEAST_DATASTORE_WRITE_IN_TRANSACTION"):
+        GcpProvider(None)
+
+
+@pytest.mark.parametrize("write_in_transaction", ["True", "true", "False", "FALSE"])
+def test_write_skips_stale_rows_and_keeps_last_duplicate(
+    monkeypatch, write_in_transaction
+):
+    monkeypatch.setenv("FEAST_DATASTORE_WRITE_IN_TRANSACTION", write_in_transaction)
+    provider, client = _get_provider_and_client()
+    table = _get_feature_view()
+    now = datetime.utcnow()
+
+    def _write(data):
+        provider.online_write_batch(
+            project="test", table=table, data=data, progress=None
+        )
+
+    def _read_lat():
+        [(_, values)] = provider.online_read(
+            project="test", table=table, entity_keys=[_driver_key(1)]
+        )
+        return values["lat"].double_val
+
+    # Several rows for the same entity in one minibatch: the last one wins
+    _write(
+        [
+            (_driver_key(1), {"lat": ValueProto(double_val=1.0)}, now, None),
+            (_driver_key(1), {"lat": ValueProto(double_val=2.0)}, now, None),
+        ]
+    )
+    assert _read_lat() == 2.0
+
+    # Rows computed from older data don't overwrite fresher values
+    _write(
+        [
+            (
+                _driver_key(1),
+                {"lat": ValueProto(double_val=3.0)},
+                now - timedelta(hours=1),
+                None,
+            )
+        ]
+    )
+    assert _read_lat() == 2.0
+
+    _write(
+        [
+            (
+                _driver_key(1),
+                {"lat": ValueProto(double_val=4.0)},
+                now + timedelta(hours=1),
+                None,
+            )
+        ]
+    )
+    assert _read_lat() == 4.0
+
+    if write_in_transaction.lower() == "true":
+        assert client.transaction_count == 3
+    else:
+        assert client.transaction_count == 0
+
+
+def _materialize(monkeypatch, provider, table):
+    feature_view = _get_feature_view()
+    offline_store = MagicMock()
+    offline_store.pull_latest_from_table_or_query.return_value = table
+    monkeypatch.setattr(
+        "feast.infra.gcp.get_offline_store_from_sources", lambda _: offline_store
+    )
+    registry = MagicMock()
+    registry.get_entity.return_value = Entity(name="driver", value_type=ValueType.INT64)
+    now = datetime.utcnow()
+
+    provider.materialize_single_feature_view(
+        feature_view,
+        now - timedelta(days=1),
+        now + timedelta(days=1),
+        registry,
+        "test",
+    )
+
+
+def _get_driver_table(num_rows: int) -> pa.Table:
+    # BigQuery results arrive as many small record batches, here of 3 rows each
+    now = datetime.utcnow()
+    return pa.concat_tables(
+        [
+            pa.Table.from_pydict(
+                {
+                    "driver": [i, i + 1, i + 2],
+                    "lat": [float(i), float(i + 1), float(i + 2)],
+                    "event_timestamp": [now, now, now],
+                }
+            )
+            for i in range(0, num_rows, 3)
+        ]
+    )
+
+
+def _record_writes(monkeypatch, provider, on_write=None):
+    chunk_sizes = []
+    online_write_batch = provider.online_write_batch
+
+    def _write(project, table, data, progress):
+        if on_write is not None:
+            on_write(len(chunk_sizes))
+        chunk_sizes.append(len(data))
+        online_write_batch(project, table, data, progress)
+
+    monkeypatch.setattr(provider, "online_write_batch", _write)
+    return chunk_sizes
+
+
+def _converter_is_running() -> bool:
+    return any(t.name == "materialize-convert" for t in threading.enumerate())
+
+
+def test_materialize_multi_batch_table(monkeypatch):
+    provider, _ = _get_provider_and_client()
+    table = _get_driver_table(30)
+    assert len(table.to_batches()) == 10
+    monkeypatch.setattr("feast.infra.gcp.MATERIALIZATION_CHUNK_SIZE", 7)
+    chunk_sizes = _record_writes(monkeypatch, provider)
+
+    _materialize(monkeypatch, provider, table)
+
+    # Chunks span record batch boundaries
+    assert chunk_sizes == [7, 7, 7, 7, 2]
+    result = provider.online_read(
+        project="test",
+        table=_get_feature_view(),
+        entity_keys=[_driver_key(i) for i in range(30)],
+    )
+    assert [values["lat"].double_val for _, values in result] == [
+        float(i) for i in range(30)
+    ]
+    assert not _converter_is_running()
+
+
+def test_materialize_converts_while_writing(monkeypatch):
+    provider, _ = _get_provider_and_client()
+    monkeypatch.setattr("feast.infra.gcp.MATERIALIZATION_CHUNK_SIZE", 3)
+    converted_chunks = []
+    next_chunk_converted = threading.Event()
+
+    def _convert(table, feature_view, join_keys):
+        rows = _convert_arrow_to_proto(table, feature_view, join_keys)
+        converted_chunks.append(len(rows))
+        if len(converted_chunks) > 1:
+            next_chunk_converted.set()
+        return rows
+
+    def _on_write(chunk_number):
+        # The next chunk is converted while the first one is being written
+        if chunk_number == 0:
+            assert next_chunk_converted.wait(timeout=10)
+
+    monkeypatch.setattr("feast.infra.gcp._convert_arrow_to_proto", _convert)
+    chunk_sizes = _record_writes(monkeypatch, provider, _on_write)
+
+    _materialize(monkeypatch, provider, _get_driver_table(30))
+
+    assert chunk_sizes == [3] * 10
+    assert converted_chunks == [3] * 10
+
+
+def test_materialize_conversion_error(monkeypatch):
+    provider, _ = _get_provider_and_client()
+    monkeypatch.setattr("feast.infra.gcp.MATERIALIZATION_CHUNK_SIZE", 3)
+    converted_chunks = []
+
+    def _convert(table, feature_view, join_keys):
+        if converted_chunks:
+            raise ValueError("conversion failed")
+        converted_chunks.append(len(table))
+        return _convert_arrow_to_proto(table, feature_view, join_keys)
+
+    monkeypatch.setattr("feast.infra.gcp._convert_arrow_to_proto", _convert)
+    chunk_sizes = _record_writes(monkeypatch, provider)
+
+    with pytest.raises(ValueError, match="conversion failed"):
+        _materialize(monkeypatch, provider, _get_driver_table(30))
+
+    assert chunk_sizes == [3]
+    assert not _converter_is_running()
+
+
+def test_materialize_write_error_stops_conversion(monkeypatch):
+    provider, _ = _get_provider_and_client()
+    # Many more chunks than fit in the queue, so the converter is blocked on a full queue
+    monkeypatch.setattr("feast.infra.gcp.MATERIALIZATION_CHUNK_SIZE", 3)
+
+    def _on_write(chunk_number):
+        raise RuntimeError("write failed")
+
+    _record_writes(monkeypatch, provider, _on_write)
+
+    with pytest.raises(RuntimeError, match="write failed"):
+        _materialize(monkeypatch, provider, _get_driver_table(60))
+
+    assert not _converter_is_running()
+
+
+def _put_legacy_row(client, driver_id: int, lat: float, event_ts: datetime):
+    # Older SDKs write feature values as a map of serialized values, updating the existing
+    # entity in place (like they do in their own write path) so other properties are kept
+    key = client.key(
+        "Project",
+        "test",
+        "Table",
+        "driver_locations",
+        "Row",
+        compute_datastore_entity_id(_driver_key(driver_id)),
+    )
+    [entity] = client.get_multi([key]) or [datastore.Entity(key=key)]
+    entity.update(
+        dict(
+            key=_driver_key(driver_id).SerializeToString(),
+            values={"lat": ValueProto(double_val=lat).SerializeToString()},
+            event_ts=event_ts,
+            created_ts=None,
+        )
+    )
+    client.entities[key] = entity
+    return key
+
+
+def test_online_read_legacy_row():
+    provider, client = _get_provider_and_client()
+    now = datetime.utcnow().replace(tzinfo=utc)
+    _put_legacy_row(client, 1, 1.0, now)
+
+    result = provider.online_read(
+        project="test",
+        table=_get_feature_view(),
+        entity_keys=[_driver_key(1), _driver_key(2)],
+    )
+
+    assert len(result) == 2
+    assert result[0][0] == now
+    assert result[0][1]["lat"].double_val == 1.0
+    assert result[1] == (None, None)
+
+
+def test_rewrite_legacy_row():
+    provider, client = _get_provider_and_client()
+    table = _get_feature_view()
+    now = datetime.utcnow().replace(tzinfo=utc)
+    key = _put_legacy_row(client, 1, 1.0, now - timedelta(hours=1))
+
+    provider.online_write_batch(
+        project="test",
+        table=table,
+        data=[(_driver_key(1), {"lat": ValueProto(double_val=2.0)}, now, None)],
+        progress=None,
+    )
+
+    # Both layouts are written, so older SDKs can still read the rewritten row
+    entity = client.entities[key]
+    expected_row = DatastoreFeatureRowProto(
+        fields=[FieldProto(name="lat", value=ValueProto(double_val=2.0))]
+    )
+    expected_row.event_timestamp.FromDatetime(now.replace(tzinfo=None))
+    assert DatastoreFeatureRowProto.FromString(entity["row"]) == expected_row
+    assert entity["values"] == {"lat": ValueProto(double_val=2.0).SerializeToString()}
+    assert "row" in entity.exclude_from_indexes
+
+    [(event_ts, values)] = provider.online_read(
+        project="test", table=table, entity_keys=[_driver_key(1)]
+    )
+    assert event_ts == now
+    assert values["lat"].double_val == 2.0
+
+
+def test_online_read_row_rewritten_by_legacy_writer():
+    provider, client = _get_provider_and_client()
+    table = _get_feature_view()
+    now = datetime.utcnow().replace(tzinfo=utc)
+
+    provider.online_write_batch(
+        project="test",
+        table=table,
+        data=[(_driver_key(1), {"lat": ValueProto(double_val=1.0)}, now, None)],
+        progress=None,
+    )
+    # An older SDK rewrites the row with fresher data, leaving the stale "row" property behind
+    key = _put_legacy_row(client, 1, 99.0, now + timedelta(hours=1))
+    assert "row" in client.entities[key]
+
+    [(event_ts, values)] = provider.online_read(
+        project="test", table=table, entity_keys=[_driver_key(1)]
+    )
+    assert event_ts == now + timedelta(hours=1)
+    assert values["lat"].double_val == 99.0
@@ -7,6 +7,7 @@ from pathlib import Path
 from typing import Iterator, Tuple, Union
 
 import pandas as pd
+import pyarrow as pa
 import pytest
 from google.cloud import bigquery
 from pytz import timezone, utc
@@ -17,6 +18,7 @@ from feast.entity import Entity
 from feast.feature import Feature
 from feast.feature_store import FeatureStore
 from feast.feature_view import FeatureView
+from feast.infra.provider import _convert_arrow_to_proto, _run_field_mapping
 from feast.repo_config import LocalOnlineStoreConfig, OnlineStoreConfig, RepoConfig
 from feast.value_type import ValueType
 
@@ -184,3 +186,148 @@ def test_bq_materialization(bq_source_type: str):
 def test_local_materialization():
     with prep_local_fs_and_fv() as (fs, fv):
         run_materialization_test(fs, fv)
+
+
+def test_convert_arrow_to_proto_multiple_join_keys():
+    fv = FeatureView(
+        name="driver_customer",
+        entities=["driver_id", "customer_id"],
+        features=[
+            Feature("trips", ValueType.INT64),
+            Feature("rating", ValueType.DOUBLE),
+        ],
+        ttl=timedelta(days=1),
+        input=BigQuerySource(
+            table_ref="project:dataset.table",
+            event_timestamp_column="ts",
+            created_timestamp_column=None,
+        ),
+    )
+    # Columns deliberately in a different order than join keys and features
+    table = pa.Table.from_pydict(
+        {
+            "rating": [4.5, 3.5],
+            "customer_id": ["a", "b"],
+            "ts": [datetime(2021, 1, 1), datetime(2021, 1, 2)],
+            "trips": [10, 20],
+            "driver_id": [1, 2],
+        }
+    )
+
+    rows = _convert_arrow_to_proto(table, fv, ["driver_id", "customer_id"])
+
+    assert [
+        (
+            list(entity_key.join_keys),
+            entity_key.entity_values[0].int64_val,
+            entity_key.entity_values[1].string_val,
+            list(features),
+            features["trips"].int64_val,
+            features["rating"].double_val,
+            event_ts.replace(tzinfo=None),
+            created_ts,
+        )
+        for entity_key, features, event_ts, created_ts in rows
+    ] == [
+        (
+            ["driver_id", "customer_id"],
+            1,
+            "a",
+            ["trips", "rating"],
+            10,
+            4.5,
+            datetime(2021, 1, 1),
+            None,
+        ),
+        (
+            ["driver_id", "customer_id"],
+            2,
+            "b",
+            ["trips", "rating"],
+            20,
+            3.5,
+            datetime(2021, 1, 2),
+            None,
+        ),
+    ]
+
+
+def test_convert_arrow_to_proto_field_mapping():
+    field_mapping = {"id": "driver_id", "ts_1": "ts"}
+    fv = get_feature_view(
+        BigQuerySource(
+            table_ref="project:dataset.table",
+            event_timestamp_column="ts",
+            created_timestamp_column="created_ts",
+            field_mapping=field_mapping,
+        )
+    )
+    ts = datetime(2021, 1, 1)
+    table = pa.Table.from_pydict(
+        {
+            "id": [1, 2],
+            "value": [0.1, 0.2],
+            "ts_1": [ts, ts + timedelta(hours=1)],
+            "created_ts": [ts + timedelta(days=1), ts + timedelta(days=2)],
+        }
+    )
+
+    rows = _convert_arrow_to_proto(
+        _run_field_mapping(table, field_mapping), fv, ["driver_id"]
+    )
+
+    assert [
+        (
+            list(entity_key.join_keys),
+            entity_key.entity_values[0].int64_val,
+            features["value"].double_val,
+            event_ts.replace(tzinfo=None),
+            created_ts.replace(tzinfo=None),
+        )
+        for entity_key, features, event_ts, created_ts in rows
+    ] == [
+        (["driver_id"], 1, 0.1, ts, ts + timedelta(days=1)),
+        (["driver_id"], 2, 0.2, ts + timedelta(hours=1), ts + timedelta(days=2)),
+    ]
+
+
+@pytest.mark.parametrize(
+    "ts_type,expected_tz",
+    [
+        (pa.timestamp("us"), "UTC"),
+        (pa.timestamp("ns"), "UTC"),
+        (pa.timestamp("us", tz="US/Pacific"), "US/Pacific"),
+        (pa.timestamp("ns", tz="US/Pacific"), "US/Pacific"),
+    ],
+)
+def test_convert_arrow_to_proto_timestamps(ts_type, expected_tz):
+    fv = get_feature_view(
+        BigQuerySource(
+            table_ref="project:dataset.table",
+            event_timestamp_column="ts",
+            created_timestamp_column="created_ts",
+        )
+    )
+    # Arrow stores timestamps as UTC instants, also for tz-aware columns
+    ts = datetime(2021, 1, 1, 12)
+    table = pa.Table.from_pydict(
+        {
+            "driver_id": pa.array([1, 2]),
+            "value": pa.array([0.1, 0.2]),
+            "ts": pa.array([ts, ts + timedelta(hours=1)], type=ts_type),
+            "created_ts": pa.array([ts, None], type=ts_type),
+        }
+    )
+
+    rows = _convert_arrow_to_proto(table, fv, ["driver_id"])
+
+    event_timestamps = [event_ts for _, _, event_ts, _ in rows]
+    created_timestamps = [created_ts for _, _, _, created_ts in rows]
+    assert [type(t) for t in event_timestamps] == [datetime, datetime]
+    assert [str(t.tzinfo) for t in event_timestamps] == [expected_tz, expected_tz]
+    assert event_timestamps == [
+        ts.replace(tzinfo=utc),
+        (ts + timedelta(hours=1)).replace(tzinfo=utc),
+    ]
+    assert str(created_timestamps[0].tzinfo) == expected_tz
+    assert created_timestamps == [ts.replace(tzinfo=utc), None]
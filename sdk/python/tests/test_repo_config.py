@@ -102,3 +102,23 @@ class TestRepoConfig:
             "project\n"
             "  field required (type=value_error.missing)",
         )
+
+    def test_not_a_mapping(self) -> None:
+        self._test_config(
+            "",
+            expect_error="1 validation error for RepoConfig\n"
+            "__root__\n"
+            "  RepoConfig expected dict not NoneType (type=type_error)",
+        )
+
+        self._test_config(
+            dedent(
+                """
+            - project: foo
+            - provider: local
+            """
+            ),
+            expect_error="1 validation error for RepoConfig\n"
+            "__root__\n"
+            "  RepoConfig expected dict not list (type=type_error)",
+        )